@@ -0,0 +1,19 @@
+"""
+Bot ke static config values ek jagah, taaki main.py aur baaki modules
+sab ek hi source se padhein.
+"""
+
+import sys
+
+MOONSHOT_BASE_URL = "https://api.moonshot.ai/v1"
+
+# Yahan apna sahi Kimi K2 model id daalo, jaise:
+# "kimi-k2-0711-preview" ya "kimi-k2-thinking" (docs se check karo)
+KIMI_MODEL = "kimi-k2-0711-preview"
+
+# sys.intern: jo bhi structure is prompt ko hold kare, sab ek hi string
+# object share karein, har jagah apni copy na banayein
+SYSTEM_PROMPT = sys.intern(
+    "You are an AI assistant inside a Telegram bot. "
+    "Reply in short, clear Hinglish (Hindi + English mix)."
+)
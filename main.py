@@ -1,6 +1,29 @@
+import asyncio
+import hashlib
 import os
 import logging
-import requests
+import queue
+import sys
+import time
+
+from logging.handlers import QueueHandler, QueueListener
+
+from typing import Awaitable, Callable
+
+import httpx
+import msgspec
+import orjson
+
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from cachetools import TTLCache
+
+from config import KIMI_MODEL, MOONSHOT_BASE_URL, SYSTEM_PROMPT
 
 from dotenv import load_dotenv
 from telegram import Update
@@ -13,104 +36,591 @@ from telegram.ext import (
 )
 
 # ------------ Logging ------------
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
+# Records ek in-memory queue me jaate hain; formatting aur write() syscalls
+# background listener thread pe hote hain, event loop pe nahi.
+_log_queue: queue.Queue = queue.Queue(-1)
+
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 )
+
+# QueueHandler pe message-only formatter zaroori hai: basicConfig warna
+# apna default formatter laga deta hai, jo prepare() me record.msg me bake
+# ho jaata hai aur listener-side handler use dobara format kar deta hai
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+
 logger = logging.getLogger(__name__)
 
 # ------------ Env vars ------------
-load_dotenv()  # local .env ke liye; Railway pe env vars se kaam ho jayega
+# Railway pe env vars platform se aate hain — wahan .env ke liye filesystem
+# scan karna bekaar I/O hai, sirf local run pe karo
+if os.environ.get("RAILWAY_ENVIRONMENT") is None:
+    load_dotenv()
+
+# Fail fast: missing config startup pe hi pakdo, pehle user message pe nahi
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+if not TELEGRAM_BOT_TOKEN:
+    raise RuntimeError("TELEGRAM_BOT_TOKEN env var set nahi hai.")
+
+MOONSHOT_API_KEY = os.environ.get("MOONSHOT_API_KEY")
+if not MOONSHOT_API_KEY:
+    raise RuntimeError("MOONSHOT_API_KEY env var set nahi hai.")
+
+
+# ------------ Response cache ------------
+# Same sawaal dobara aaya to paisa aur ~seconds ki latency kyun kharch karein?
+# Exact-match TTL cache: 10 min tak same prompt ka same jawab. TTL short hai
+# kyunki temperature=0.7 pe responses waise bhi thode vary karte hain.
+_cache: TTLCache = TTLCache(maxsize=1024, ttl=600)
+_cache_lock = asyncio.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+# In-flight dedup: key -> chal rahi request ka Future (classic singleflight)
+_inflight: dict[bytes, asyncio.Future] = {}
+
+# Streaming ke dauraan Telegram message edits ke beech minimum gap (seconds);
+# Telegram ki ~1 edit/sec limit se thoda upar
+STREAM_EDIT_INTERVAL = 1.0
+
+# Filter composition ek hi baar evaluate-ready bana lo, har update pe
+# naya filter graph mat banao
+TEXT_FILTER = filters.TEXT & ~filters.COMMAND
+
+# ------------ Trivial-message fast path ------------
+# Greetings, "thanks", sirf-emoji ya bahut lambe messages ke liye paid LLM
+# call ki zaroorat nahi — ek dict lookup / length check me nipta do.
+MAX_MESSAGE_LEN = 2000
+
+_CANNED_REPLIES = {
+    "hi": "Hi! 👋",
+    "hii": "Hi hi! 👋",
+    "hello": "Hello! 🙂",
+    "hey": "Hey! 👋",
+    "namaste": "Namaste! 🙏",
+    "thanks": "Welcome 🙂",
+    "thank you": "Koi baat nahi 🙂",
+    "shukriya": "Koi baat nahi 🙂",
+    "ok": "👍",
+    "okay": "👍",
+}
+
+
+def _canned_reply(user_text: str) -> str | None:
+    """Trivial message ho to canned jawab, warna None (LLM ko jaane do)."""
+    stripped = user_text.strip()
+    if len(stripped) > MAX_MESSAGE_LEN:
+        return "Message bahut lamba hai 😅 thoda chhota karke bhejo."
+    canned = _CANNED_REPLIES.get(stripped.casefold().rstrip("!. "))
+    if canned is not None:
+        return canned
+    if not any(ch.isalnum() for ch in stripped):
+        # Sirf emoji/symbols — iska LLM se jawab nahi banta
+        return "🙂👍"
+    return None
+
+
+# ------------ Per-user rate limit ------------
+# Ek hi user poora Moonshot budget na uda de: token bucket, 10 req/min.
+# Reject LLM call se pehle hi ho jaata hai — wasted paisa zero.
+RATE_LIMIT_CAPACITY = 10.0
+RATE_LIMIT_REFILL_PER_SEC = RATE_LIMIT_CAPACITY / 60.0
+_BUCKET_GC_AFTER = 3600.0
+
+# user_id -> (tokens, last_refill_ts)
+_buckets: dict[int, tuple[float, float]] = {}
+_buckets_lock = asyncio.Lock()
+_buckets_last_gc = 0.0
+
+
+async def _allow_request(user_id: int | None) -> bool:
+    """Token bucket check; True matlab request aage jaa sakti hai."""
+    global _buckets_last_gc
+    if user_id is None:
+        return True
+
+    now = time.monotonic()
+    async with _buckets_lock:
+        # Ghante me ek baar stale buckets saaf karo
+        if now - _buckets_last_gc > _BUCKET_GC_AFTER:
+            _buckets_last_gc = now
+            stale = [
+                uid
+                for uid, (_, last) in _buckets.items()
+                if now - last > _BUCKET_GC_AFTER
+            ]
+            for uid in stale:
+                del _buckets[uid]
+
+        tokens, last = _buckets.get(user_id, (RATE_LIMIT_CAPACITY, now))
+        tokens = min(
+            RATE_LIMIT_CAPACITY, tokens + (now - last) * RATE_LIMIT_REFILL_PER_SEC
+        )
+        if tokens < 1.0:
+            _buckets[user_id] = (tokens, now)
+            return False
+        _buckets[user_id] = (tokens - 1.0, now)
+        return True
+
+
+# ------------ Micro-batch dispatcher ------------
+# Bursty load (group chats) me har message apni HTTPS POST turant daagta tha.
+# Ye chhota window requests ko ikattha karke ek saath launch karta hai taaki
+# HTTP/2 client inhe ek hi connection pe multiplex kare.
+BATCH_WINDOW_MS = 15
+MAX_BATCH = 16
+
+_dispatch_queue: asyncio.Queue | None = None
+_dispatch_task: asyncio.Task | None = None
+
+# ------------ Static payload pieces ------------
+# Ye har call pe same rehte hain, isliye ek hi baar banao. _SYSTEM_MSG ko
+# kabhi mutate mat karna — saari requests isi object ko share karti hain.
+# Moonshot ka server-side prompt caching byte-identical prefix pe hi lagta
+# hai, isliye system message me kabhi per-user cheez (naam, time, user_id)
+# mat daalna — warna prefill discount ud jaayega.
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_PAYLOAD_DEFAULTS = {
+    "model": KIMI_MODEL,
+    "max_tokens": 512,
+    "temperature": 0.7,
+    "stream": True,
+}
+
+
+def _cache_key(user_message: str) -> bytes:
+    return hashlib.sha256(
+        f"{KIMI_MODEL}\0{SYSTEM_PROMPT}\0{user_message}".encode()
+    ).digest()
+
+
+# ------------ Semantic cache (optional) ------------
+# Exact-match cache "hi" vs "hii" vs "hello bhai" ko alag treat karta hai.
+# Ye layer local embeddings se milte-julte messages pakadti hai: ~5ms ka
+# local lookup vs 1-3s ka LLM call. SEMANTIC_CACHE_ENABLED=1 se on hota hai
+# (fastembed + numpy chahiye, isliye optional).
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-MOONSHOT_API_KEY = os.getenv("MOONSHOT_API_KEY")
 
-MOONSHOT_BASE_URL = "https://api.moonshot.ai/v1"
+class SemanticCache:
+    """
+    Chhota in-process vector cache, SoA layout me: embeddings ek hi
+    pre-allocated contiguous float32 matrix me (dict/object per entry
+    nahi), responses parallel list me. Similarity ek hi matrix-vector
+    multiply se nikalti hai aur insert sirf ek row-write hai — matrix
+    kabhi copy nahi hota.
+    """
 
-# Yahan apna sahi Kimi K2 model id daalo, jaise:
-# "kimi-k2-0711-preview" ya "kimi-k2-thinking" (docs se check karo)
-KIMI_MODEL = "kimi-k2-0711-preview"
+    def __init__(self, threshold: float = 0.92, max_entries: int = 2048) -> None:
+        import numpy as np
+        from fastembed import TextEmbedding
+
+        self._np = np
+        self._model = TextEmbedding("sentence-transformers/all-MiniLM-L6-v2")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.embeddings = np.zeros((max_entries, 384), dtype=np.float32)
+        self.responses: list[str | None] = [None] * max_entries
+        self._count = 0
+        self._write = 0  # ring-buffer cursor: bhar jaane pe oldest overwrite (FIFO)
+
+    def embed(self, text: str):
+        np = self._np
+        vec = next(iter(self._model.embed([text]))).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec
+
+    def lookup(self, query_vec) -> str | None:
+        if self._count == 0:
+            return None
+        sims = self.embeddings[: self._count] @ query_vec
+        best = int(sims.argmax())
+        if sims[best] >= self.threshold:
+            return self.responses[best]
+        return None
+
+    def store(self, query_vec, response: str) -> None:
+        self.embeddings[self._write] = query_vec
+        self.responses[self._write] = response
+        self._write = (self._write + 1) % self.max_entries
+        self._count = min(self._count + 1, self.max_entries)
+
+
+_semantic_cache: SemanticCache | None = None
+
+
+# ------------ Shared HTTP client ------------
+# Ek hi AsyncClient reuse karte hain (connection pooling), taaki har message
+# pe naya TCP/TLS handshake na ho. Lifecycle main() ke post_init/post_shutdown
+# hooks se manage hota hai.
+_http: httpx.AsyncClient | None = None
+
+
+async def _post_init(application) -> None:
+    global _http, _semantic_cache, _dispatch_queue, _dispatch_task
+    # http2=True: saare concurrent user calls ek hi connection pe multiplex
+    # ho jaate hain, har request pe TLS handshake nahi lagta
+    _http = httpx.AsyncClient(
+        base_url=MOONSHOT_BASE_URL,
+        http2=True,
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+        headers={
+            "Authorization": f"Bearer {MOONSHOT_API_KEY}",
+            "Content-Type": "application/json",
+            # Compressed response bodies: httpx transparently decompress
+            # karta hai, brotli package installed ho to br bhi negotiate hota hai
+            "Accept-Encoding": "gzip, br",
+        },
+    )
 
+    _dispatch_queue = asyncio.Queue()
+    _dispatch_task = asyncio.create_task(_dispatch_worker())
 
-# ------------ Moonshot / Kimi K2 function ------------
+    if SEMANTIC_CACHE_ENABLED:
+        try:
+            # Model load blocking hai, isliye thread me
+            _semantic_cache = await asyncio.to_thread(SemanticCache)
+            logger.info("Semantic cache enabled.")
+        except ImportError:
+            logger.warning(
+                "SEMANTIC_CACHE_ENABLED hai par fastembed/numpy installed "
+                "nahi hai; semantic cache skip kar rahe hain."
+            )
+
+
+async def _post_shutdown(application) -> None:
+    global _http, _dispatch_queue, _dispatch_task
+    if _dispatch_task is not None:
+        _dispatch_task.cancel()
+        try:
+            await _dispatch_task
+        except asyncio.CancelledError:
+            pass
+        _dispatch_task = None
+    _dispatch_queue = None
+    if _http is not None:
+        await _http.aclose()
+        _http = None
 
-def call_kimi_k2(user_message: str, user_id: int | None = None) -> str:
+
+async def _run_fetch(key: bytes, user_message: str, on_partial, fut: asyncio.Future) -> None:
+    try:
+        result = await _fetch_kimi_reply(key, user_message, on_partial)
+    except Exception as exc:
+        if not fut.done():
+            fut.set_exception(exc)
+    else:
+        if not fut.done():
+            fut.set_result(result)
+
+
+async def _run_batch(batch: list[tuple]) -> None:
+    await asyncio.gather(
+        *(_run_fetch(*item) for item in batch), return_exceptions=True
+    )
+
+
+async def _dispatch_worker() -> None:
     """
-    User ka message Moonshot Kimi K2 ko bhejta hai aur reply return karta hai.
+    Queue se requests uthata hai, BATCH_WINDOW_MS tak ya MAX_BATCH tak
+    accumulate karta hai, phir sabko ek saath launch kar deta hai. Batch ko
+    await nahi karte — warna worker 30s ke streams ke peeche atak jaata.
     """
-    if not MOONSHOT_API_KEY:
-        raise RuntimeError("MOONSHOT_API_KEY env var set nahi hai.")
+    assert _dispatch_queue is not None
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _dispatch_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_MS / 1000
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(_dispatch_queue.get(), remaining)
+                )
+            except asyncio.TimeoutError:
+                break
+        asyncio.create_task(_run_batch(batch))
 
-    url = f"{MOONSHOT_BASE_URL}/chat/completions"
 
-    headers = {
-        "Authorization": f"Bearer {MOONSHOT_API_KEY}",
-        "Content-Type": "application/json",
-    }
+# ------------ Response schema ------------
+# SSE chunks ko dict-indexing ke bajaye typed Structs me decode karte hain:
+# orjson.loads + dict walk se tez, aur schema drift pe specific DecodeError
+# milta hai, broad except nahi.
+
+class _Delta(msgspec.Struct):
+    content: str | None = None
+
+
+class _StreamChoice(msgspec.Struct):
+    delta: _Delta = msgspec.field(default_factory=_Delta)
+
+
+class _PromptTokensDetails(msgspec.Struct):
+    cached_tokens: int | None = None
+
+
+class _Usage(msgspec.Struct):
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    cached_tokens: int | None = None
+    prompt_cache_hit_tokens: int | None = None
+    prompt_tokens_details: _PromptTokensDetails | None = None
+
+
+class _StreamChunk(msgspec.Struct):
+    choices: list[_StreamChoice] = msgspec.field(default_factory=list)
+    usage: _Usage | None = None
+
+
+class _MoonshotError(Exception):
+    """Moonshot se aaya abnormal response; friendly_message user ko jaata hai."""
+
+    def __init__(self, friendly_message: str) -> None:
+        super().__init__(friendly_message)
+        self.friendly_message = friendly_message
+
+
+class _RetryableMoonshotError(_MoonshotError):
+    """Transient (502/503/504, Retry-After wala 429) — retry karna safe hai."""
+
+
+def _log_prompt_cache_usage(usage: _Usage) -> None:
+    """
+    Stream ke aakhri chunk me usage aata hai; server-side prompt-cache hit
+    tokens log karo taaki prefix caching kaam kar rahi hai ya nahi, dikhe.
+    """
+    cached = usage.cached_tokens
+    if cached is None and usage.prompt_tokens_details is not None:
+        cached = usage.prompt_tokens_details.cached_tokens
+    if cached is None:
+        cached = usage.prompt_cache_hit_tokens
+    logger.info(
+        "Moonshot usage: prompt=%s, completion=%s, cached_prompt=%s",
+        usage.prompt_tokens,
+        usage.completion_tokens,
+        cached,
+    )
+
+
+# ------------ Moonshot / Kimi K2 function ------------
+
+async def call_kimi_k2(
+    user_message: str,
+    user_id: int | None = None,
+    on_partial: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
+    """
+    User ka message Moonshot Kimi K2 ko bhejta hai aur reply return karta hai.
+    Async hai taaki ek slow LLM call baaki users ko block na kare.
+
+    on_partial diya ho to streaming ke dauraan accumulated text ke saath
+    call hota hai (Telegram placeholder edit karne ke liye).
+    """
+    if _http is None:
+        raise RuntimeError("HTTP client abhi initialize nahi hua.")
+
+    key = _cache_key(user_message)
+    async with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache_stats["hits"] += 1
+            return cached
+
+    # Single-flight: same prompt ke liye pehle se koi call chal rahi hai to
+    # usi ka result await karo, 50 duplicate Moonshot calls mat bhejo.
+    fut = _inflight.get(key)
+    if fut is not None:
+        return await fut
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        if _dispatch_queue is not None:
+            await _dispatch_queue.put((key, user_message, on_partial, fut))
+            return await fut
+        # Dispatcher abhi start nahi hua (startup window) — direct call
+        reply = await _fetch_kimi_reply(key, user_message, on_partial)
+        fut.set_result(reply)
+        return reply
+    except Exception as exc:
+        if not fut.done():
+            fut.set_exception(exc)
+        raise
+    finally:
+        _inflight.pop(key, None)
+        # Agar koi waiter nahi tha to pending exception warning na aaye
+        if fut.done() and fut.exception() is not None:
+            fut.exception()
+
+
+async def _fetch_kimi_reply(
+    key: bytes,
+    user_message: str,
+    on_partial: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
+    """
+    Cache-miss path: semantic lookup + actual Moonshot HTTP call (SSE stream).
+    """
+    query_vec = None
+    if _semantic_cache is not None:
+        query_vec = await asyncio.to_thread(_semantic_cache.embed, user_message)
+        cached = _semantic_cache.lookup(query_vec)
+        if cached is not None:
+            async with _cache_lock:
+                _cache_stats["hits"] += 1
+            return cached
+
+    async with _cache_lock:
+        _cache_stats["misses"] += 1
 
     payload = {
-        "model": KIMI_MODEL,
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI assistant inside a Telegram bot. "
-                    "Reply in short, clear Hinglish (Hindi + English mix)."
-                ),
-            },
-            {
-                "role": "user",
-                "content": user_message,
-            },
-        ],
-        "max_tokens": 512,
-        "temperature": 0.7,
+        **_PAYLOAD_DEFAULTS,
+        "messages": [_SYSTEM_MSG, {"role": "user", "content": user_message}],
     }
 
-    # HTTP request
+    # Transient failures (timeout, 502/503/504, Retry-After wala 429) pe
+    # backoff + jitter ke saath 3 attempts; auth errors retry nahi hote.
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential_jitter(initial=0.5, max=4),
+            retry=retry_if_exception_type(
+                (
+                    httpx.TimeoutException,
+                    httpx.RemoteProtocolError,
+                    _RetryableMoonshotError,
+                )
+            ),
+            reraise=True,
+        ):
+            with attempt:
+                reply = await _stream_completion(payload, on_partial)
+    except _MoonshotError as exc:
+        return exc.friendly_message
     except Exception as e:
         logger.exception("Moonshot API request fail hua: %s", e)
         return "Moonshot API se connect nahi ho pa raha 😅. Internet ya API service check karo."
 
-    # Agar HTTP status 200 nahi hai to error handle karo
-    if not resp.ok:
-        try:
-            err_json = resp.json()
-        except Exception:
-            err_json = None
+    async with _cache_lock:
+        _cache[key] = reply
+    if _semantic_cache is not None and query_vec is not None:
+        _semantic_cache.store(query_vec, reply)
+    return reply
 
-        logger.error(
-            "Moonshot API error: status=%s, body=%s",
-            resp.status_code,
-            err_json,
-        )
 
-        if resp.status_code in (401, 403):
-            return (
-                "Moonshot API key ya billing me problem lag rahi hai "
-                f"(HTTP {resp.status_code}). Dashboard me API key / billing check karo."
+async def _stream_completion(
+    payload: dict,
+    on_partial: Callable[[str], Awaitable[None]] | None,
+) -> str:
+    """
+    Ek SSE stream chalata hai aur poora reply return karta hai; poore 512
+    tokens ka wait karne ke bajaye deltas aate hi on_partial ko forward
+    karta hai. Abnormal responses pe _MoonshotError raise karta hai.
+    """
+    # orjson stdlib json se kaafi fast hai, khaas kar Devanagari/emoji
+    # heavy text pe; Content-Type header client pe already set hai
+    body = orjson.dumps(payload)
+    chunks: list[str] = []
+    async with _http.stream("POST", "/chat/completions", content=body) as resp:
+        # Agar HTTP status 200 nahi hai to error handle karo
+        if not resp.is_success:
+            await resp.aread()
+            try:
+                err_json = orjson.loads(resp.content)
+            except Exception:
+                err_json = None
+
+            # 401/403/429 expected operational errors hain (billing/limit),
+            # inke liye error-level body dump ki zaroorat nahi
+            if resp.status_code in (401, 403, 429):
+                logger.warning("Moonshot %d: %s", resp.status_code, err_json)
+            else:
+                logger.error(
+                    "Moonshot API error: status=%s, body=%s",
+                    resp.status_code,
+                    err_json,
+                )
+
+            if resp.status_code in (401, 403):
+                raise _MoonshotError(
+                    "Moonshot API key ya billing me problem lag rahi hai "
+                    f"(HTTP {resp.status_code}). Dashboard me API key / billing check karo."
+                )
+
+            if resp.status_code == 429:
+                friendly = (
+                    "Moonshot API limit cross ho gayi (429). "
+                    "Thodi der baad try karo ya usage/billing badhao."
+                )
+                retry_after = _parse_retry_after(resp.headers.get("Retry-After"))
+                if retry_after is not None:
+                    # Server ne khud bataya kab aana hai — ruk ke retry karo
+                    await asyncio.sleep(retry_after)
+                    raise _RetryableMoonshotError(friendly)
+                raise _MoonshotError(friendly)
+
+            friendly = (
+                f"Moonshot API se error aa gaya (HTTP {resp.status_code}). "
+                "Key, model name ya billing check karo."
             )
+            if resp.status_code in (502, 503, 504):
+                raise _RetryableMoonshotError(friendly)
+            raise _MoonshotError(friendly)
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data_str = line[5:].strip()
+            if data_str == "[DONE]":
+                break
+
+            try:
+                chunk = msgspec.json.decode(data_str, type=_StreamChunk)
+            except msgspec.DecodeError:
+                logger.warning("Moonshot se ajeeb SSE chunk aaya: %r", data_str)
+                continue
+
+            if chunk.usage is not None:
+                _log_prompt_cache_usage(chunk.usage)
+
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                chunks.append(delta)
+                if on_partial is not None:
+                    await on_partial("".join(chunks))
+
+    if not chunks:
+        logger.error("Moonshot stream se koi content nahi mila")
+        raise _MoonshotError(
+            "Moonshot se ajeeb response aaya 😅. Thodi der baad try karo."
+        )
 
-        if resp.status_code == 429:
-            return (
-                "Moonshot API limit cross ho gayi (429). "
-                "Thodi der baad try karo ya usage/billing badhao."
-            )
+    return "".join(chunks)
 
-        return (
-            f"Moonshot API se error aa gaya (HTTP {resp.status_code}). "
-            "Key, model name ya billing check karo."
-        )
 
-    # Successful response
+def _parse_retry_after(value: str | None) -> float | None:
+    """Retry-After header (seconds form) parse karo, 10s pe cap."""
+    if not value:
+        return None
     try:
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
-    except Exception:
-        logger.exception("Unexpected response from Moonshot: %s", resp.text)
-        return "Moonshot se ajeeb response aaya 😅. Thodi der baad try karo."
+        return min(float(value), 10.0)
+    except ValueError:
+        return None
 
 
 # ------------ Telegram handlers ------------
@@ -132,6 +642,21 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(text)
 
 
+async def cachestats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    hits = _cache_stats["hits"]
+    misses = _cache_stats["misses"]
+    total = hits + misses
+    ratio = (hits / total * 100) if total else 0.0
+    text = (
+        f"Cache stats:\n"
+        f"hits: {hits}\n"
+        f"misses: {misses}\n"
+        f"hit ratio: {ratio:.1f}%\n"
+        f"entries: {len(_cache)}/{_cache.maxsize}"
+    )
+    await update.message.reply_text(text)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.message.text:
         return
@@ -141,8 +666,46 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     logger.info("User %s: %s", user_id, user_text)
 
+    canned = _canned_reply(user_text)
+    if canned is not None:
+        await update.message.reply_text(canned)
+        return
+
+    if not await _allow_request(user_id):
+        await update.message.reply_text(
+            "Aaram se bhai 😅 bahut saare messages aa gaye. "
+            "Thodi der ruk ke try karo."
+        )
+        return
+
+    # Placeholder pehle bhejo, phir streaming deltas se edit karte raho —
+    # user ko first token seconds ke bajaye turant dikhna shuru hota hai.
+    placeholder = await update.message.reply_text("…")
+    last_edit = 0.0
+    last_text = "…"
+
+    async def _on_partial(text: str) -> None:
+        nonlocal last_edit, last_text
+        now = time.monotonic()
+        # Telegram ~1 edit/sec allow karta hai, isliye throttle
+        if now - last_edit < STREAM_EDIT_INTERVAL or text == last_text:
+            return
+        last_edit = now
+        try:
+            await context.bot.edit_message_text(
+                chat_id=placeholder.chat_id,
+                message_id=placeholder.message_id,
+                text=text,
+            )
+        except Exception:
+            # last_text update nahi karte — fail hua to final edit ka
+            # reply_text != last_text guard ise dobara bhejne dega
+            logger.debug("Partial edit fail hua", exc_info=True)
+        else:
+            last_text = text
+
     try:
-        reply_text = call_kimi_k2(user_text, user_id)
+        reply_text = await call_kimi_k2(user_text, user_id, on_partial=_on_partial)
     except Exception:
         logger.exception("Moonshot API error")
         reply_text = (
@@ -150,22 +713,48 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "Thodi der baad dobara try kar lena."
         )
 
-    await update.message.reply_text(reply_text)
+    if reply_text != last_text:
+        try:
+            await context.bot.edit_message_text(
+                chat_id=placeholder.chat_id,
+                message_id=placeholder.message_id,
+                text=reply_text,
+            )
+        except Exception:
+            logger.exception("Final edit fail hua, naya message bhej rahe hain")
+            await update.message.reply_text(reply_text)
 
 
 # ------------ Main (no asyncio.run) ------------
 
 def main() -> None:
-    if not TELEGRAM_BOT_TOKEN:
-        raise RuntimeError("TELEGRAM_BOT_TOKEN env var set nahi hai.")
-
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    # uvloop: libuv-backed event loop, socket I/O pe default loop se fast.
+    # Linux/macOS only; na mile to default loop se kaam chal jaata hai.
+    if sys.platform != "win32":
+        try:
+            import uvloop
+
+            uvloop.install()
+            logger.info("uvloop installed as event loop policy.")
+        except ImportError:
+            logger.info("uvloop installed nahi hai, default event loop use hoga.")
+
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .connection_pool_size(256)
+        .pool_timeout(30)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-    )
+    application.add_handler(CommandHandler("cachestats", cachestats_command))
+    # block=False: handlers sequentially nahi, concurrent tasks me chalte hain
+    application.add_handler(MessageHandler(TEXT_FILTER, handle_message, block=False))
 
     logger.info("Bot started on Railway (run_polling)...")
     application.run_polling()